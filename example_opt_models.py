@@ -4,55 +4,113 @@ This is not an actual program.
 
 
 import opt_models as models
+import numpy as np
 import pandas as pd
+import time
 from openpyxl import Workbook, load_workbook
 
-# read input data from excel files to DataFrames
-product_data = pd.read_excel('product_data.xlsx',index_col=0)
-mold_data = pd.read_excel('mold_data.xlsx',index_col=0)
-prev_mount = pd.read_excel('mounted.xlsx',index_col=0)['part']
-# solver termination conditons (terminate if MIPGap = 0 or time elapsed 100secs)
-term_conds = [(0,100)]
-# production line parameters
-hours, arms, mounts = 120, 2, 2
-
-# build a model to allocate production that maximize profits while meeting demand
-model1 = models.MaxProfit(hours,arms,mounts)
-model1.read_data(product_data, mold_data)
-model1.build_model()
-# uncomment the line below to write the model to a .lp file to inspect the formulation
-# model1.write('filename.lp')
-model1.optimize(term_conds)
-model1.update_production()
-
-# get result from profit optimization
-produced = model1.get_production()
-# concatenate produced to product_data for use in scheduling optimization
-product_data = pd.concat((product_data,produced),axis=1)
-
-# build a second model to fit the desired production into a schedule
-# that minimizes mold changes
-model2 = models.ProductionSchedule(hours,arms,mounts)
-model2.read_data(product_data, mold_data,prev_mount)
-model2.build_phase1()
-# model2.write('filename2.lp')
-model2.optimize(term_conds)
-model2.update_production()
-model2.build_phase2()
-# model2.write('filename3.lp')
-model2.optimize(term_conds)
-model2.update_schedule()
-
-schedule = model2.get_schedule()
-# try loading excel file
-try:
-    wb = load_workbook('production_schedule_1.xlsx')
-# if it doesn't exist, create a new one
-except FileNotFoundError:
-    wb = Workbook()
-
-model2.write_schedule(wb)
-date = 1
-wb.save('production_schedule_{}.xlsx'.format(date))
-# get the last molds to use as input for next weeks scheduling
-next_mount = model2.get_last_molds()
+# everything is in main() because PlantSchedule.schedule starts new processes,
+# which import this file again on platforms that spawn them (Windows, macOS, ...)
+def main():
+    # read input data from excel files to DataFrames
+    product_data = pd.read_excel('product_data.xlsx',index_col=0)
+    mold_data = pd.read_excel('mold_data.xlsx',index_col=0)
+    prev_mount = pd.read_excel('mounted.xlsx',index_col=0)['part']
+    # solver termination conditons (terminate if MIPGap = 0 or time elapsed 100secs)
+    term_conds = [(0,100)]
+    # production line parameters
+    hours, arms, mounts = 120, 2, 2
+
+    # build a model to allocate production that maximize profits while meeting demand
+    model1 = models.MaxProfit(hours,arms,mounts)
+    model1.read_data(product_data, mold_data)
+    model1.build_model()
+    # uncomment the line below to write the model to a .lp file to inspect the formulation
+    # model1.write('filename.lp')
+    model1.optimize(term_conds)
+    model1.update_production()
+
+    # get result from profit optimization
+    produced = model1.get_production()
+    # concatenate produced to product_data for use in scheduling optimization
+    product_data = pd.concat((product_data,produced),axis=1)
+
+    # build a second model to fit the desired production into a schedule
+    # that minimizes mold changes
+    model2 = models.ProductionSchedule(hours,arms,mounts)
+    model2.read_data(product_data, mold_data,prev_mount)
+    model2.build_phase1()
+    # model2.write('filename2.lp')
+    model2.optimize(term_conds)
+    model2.update_production()
+    # keep up to 5 alternative schedules with a phase2 objective (parts per
+    # mount plus mold changes) at most 10% worse than the best one
+    model2.build_phase2(pool_size=5,pool_gap=0.1)
+    # model2.write('filename3.lp')
+    model2.optimize(term_conds)
+    model2.update_schedule()
+    # alternative schedules from the same solve
+    model2.update_pool()
+    for n, alt in enumerate(model2.get_pool()):
+        print(n, alt['mold_changes'], alt['last_molds'].to_dict())
+    # to use the second best schedule instead, uncomment the line below
+    # model2.select_solution(1)
+
+    schedule = model2.get_schedule()
+    # try loading excel file
+    try:
+        wb = load_workbook('production_schedule_1.xlsx')
+    # if it doesn't exist, create a new one
+    except FileNotFoundError:
+        wb = Workbook()
+
+    model2.write_schedule(wb)
+    date = 1
+    wb.save('production_schedule_{}.xlsx'.format(date))
+    # get the last molds to use as input for next weeks scheduling
+    next_mount = model2.get_last_molds()
+
+    # plan against several demand scenarios instead of one demand column,
+    # and report how the build and solve times grow with the number of scenarios.
+    # here the scenarios are the demand +-20% at random
+    rng = np.random.RandomState(0)
+    print('scenarios, build secs, solve secs')
+    for n_scenarios in (10,50,100,200):
+        noise = rng.uniform(0.8,1.2,(len(product_data),n_scenarios))
+        scenarios = pd.DataFrame(noise*product_data[['demand']].values,index=product_data.index).round()
+        model3 = models.MaxProfit(hours,arms,mounts)
+        model3.read_data(product_data, mold_data)
+        model3.read_scenarios(scenarios)
+        model3.build_scenario_model()
+        # time the whole optimize call, model3.Runtime only covers the
+        # last (tolerance,time_limit) pair of term_conds
+        start = time.perf_counter()
+        model3.optimize(term_conds)
+        solve_time = time.perf_counter() - start
+        print(n_scenarios, round(model3.build_time,3), round(solve_time,3))
+    model3.update_production()
+    # parts that miss demand in each scenario
+    shortfalls = model3.get_shortfalls()
+
+    # plant with several machines sharing the molds in mold_data,
+    # each machine is scheduled in its own process
+    machines = pd.DataFrame({'hours':[120,120],'arms':[2,3],'mounts':[2,2]},index=['line1','line2'])
+    # previous mounts of each machine, machines not in the dict start empty
+    prev_mounts = {'line1':prev_mount}
+    plant = models.PlantSchedule(machines)
+    # product_data needs the produced column, here the one from model1
+    plant.read_data(product_data, mold_data, prev_mounts)
+    plant.build_model()
+    plant.optimize(term_conds)
+    plant.update_allocation()
+    # above 1 if the machines can't make everything model1 planned
+    print('utilization', plant.get_utilization())
+    if not plant.schedule(term_conds):
+        # exceptions of the machines that failed, keyed by machine name
+        print(plant.get_errors())
+    plant.write_schedule(wb)
+    wb.save('production_schedule_{}.xlsx'.format(date))
+    next_mounts = plant.get_last_molds()
+
+if __name__ == '__main__':
+    main()
@@ -4,14 +4,83 @@ for Alpha Systems.
 
 import gurobipy as gp
 from gurobipy import GRB
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
+import time
 import deep_ordered_dict as dod
 from workbook_utils import set_border, fit_column
 from openpyxl.styles import Alignment
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+def write_sheet(ws,sched,hours,arms,mounts,start_time):
+    """write a production schedule (nested DeepOrderedDict as built by
+    ProductionSchedule.update_schedule) to the openpyxl Worksheet ws
+    """
+    old_time = start_time
+    current_time = old_time
+    align_center = Alignment('center','center')
+    
+    # start entries on row 3, 1st and 2nd for titles, etc.
+    # 1st column for date, 2nd for time
+
+    # write first date in first entry
+    ws.cell(row=3,column=1,value=start_time.date())
+    # write time in all rows in 2nd column,
+    for i in range(3,hours+3):
+        ws.cell(row=i,column=2,value=current_time.time())
+        current_time = old_time + pd.Timedelta(hours=1)
+        # if date changes (next day), write date in 1st column
+        if current_time.date() != old_time.date():
+            ws.cell(row=i,column=1,value=current_time.date())
+        old_time = current_time
+    # set border and fit date/time column
+    set_border(ws,3,1,hours+2)
+    set_border(ws,3,2,hours+2)
+    fit_column(ws,3,1,hours+2)
+    fit_column(ws,3,2,hours+2)
+    # set border over top of schedule
+    set_border(ws,2,3,2,arms*mounts+2)
+
+    # enter productions
+    # first column of production entries
+    col = 3
+    for mt in sched:
+        # keys of sched are mount numbers
+        mount = sched[mt]
+        # enter column (mount) label
+        cell = ws.cell(2,col,mt)
+        cell.alignment = align_center
+        # start at row 3
+        row = 3
+        for h in mount:
+            # keys of mount are mold numbers
+            mold = mount[h]     
+            for k in mold:
+                # keys of mold are part numbers
+                cell = ws.cell(row,col,k)
+                cell.alignment = align_center
+                # if production of part k > 1,
+                # enter production in the cell below
+                if mold[k] > 1:
+                    ws.cell(row+1,col,mold[k])
+                # set border for production of current part
+                set_border(ws,row,col,row+mold[k]-1)
+                # set row to current row + production hours of part
+                row += mold[k]  
+            # skip one row for mold change
+            row += 1
+        # fit column width >= widest value in the column
+        fit_column(ws,3,col,hours+2)
+        # move col to the next column on the right
+        col += 1
+    # add freez panse 
+    ws.freeze_panes = 'C3'
 
 class BaseClass:    # probably needs a better name
-    def __init__(self, hours, arms, mounts, name):
+    def __init__(self, hours, arms, mounts, name, env=None):
         """Initialize production capacity by setting the number of arms,
         mounts, and production hours.
 
@@ -21,11 +90,12 @@ class BaseClass:    # probably needs a better name
         arms: int--number of total arms available
         mounts: int--number of mounts per arm
         name: str--name of the sover model
+        env: gp.Env--Gurobi environment of the model, None for the default one
         """
         self.hours = hours
         self.arms = arms
         self.mounts = mounts
-        self.model = gp.Model(name=name)
+        self.model = gp.Model(name=name,env=env)
         self.sched = None
         
     def __getattr__(self, attr):
@@ -116,6 +186,31 @@ class MaxProfit(BaseClass):
         self.inv = self.data['inv']
         self.profits = self.data['profit']
         self.desired = self.data['desired']
+
+    def read_scenarios(self, demand_scenarios, weights=None):
+        """Reads demand scenarios needed for building the model of 
+        self.build_scenario_model. Must be called after self.read_data.
+
+        Parameters
+        ----------
+        demand_scenarios: pd.DataFrame
+            a data frame indexed (row) by part number(string) with one column
+            of demand (int) per scenario.
+        weights: pd.Series
+            a series indexed by the columns of demand_scenarios with the 
+            probability (or any non negative weight) of each scenario.
+            If None, all scenarios are equally likely.
+
+        Notes
+        -----
+        self.demands is replaced by the expected demand of each part.
+        """
+        self.scenarios = demand_scenarios.loc[self.parts]
+        if weights is None:
+            weights = pd.Series(1,index=self.scenarios.columns)
+        weights = weights[self.scenarios.columns]
+        self.weights = weights/weights.sum()
+        self.demands = self.scenarios.mul(self.weights,axis=1).sum(axis=1)
         
     def build_model(self):
         """Build a profit maximization linear program from the attributes 
@@ -171,6 +266,98 @@ class MaxProfit(BaseClass):
         # sum of profit*(production + inventory - demand) with penalties for each product not meeting demand
         self.obj = self.model.setObjective(gp.quicksum((self.profits[i]*(self.pro_vars[i]+self.inv[i]-self.demands[i])-BIG_M2*self.a[i]) for i in self.parts),GRB.MAXIMIZE)
 
+    def build_scenario_model(self):
+        """Build a two-stage profit maximization linear program over the
+        demand scenarios created by self.read_scenarios.
+
+        Same as self.build_model, except that the production (first stage) 
+        is shared by all scenarios, while whether demand is met (a) is 
+        decided per scenario, and the objective is the expected profit.
+        The constraints are built as sparse matrices (A @ x) in one call per
+        constraint group, so the build time stays small for hundreds of
+        scenarios. The build time (secs) is stored in self.build_time.
+
+        Notes
+        -----
+        This method only builds the model without optmizing it.
+        The production upper bound (const4) uses the expected demand.
+        i is used to subscript part number, j for mold number and s for scenario.
+        """
+        start = time.perf_counter()
+        # prep data
+        desired = self.data[['inv','desired']].max(axis=1).clip(lower=1)
+        scenarios = self.scenarios.columns
+        n, S, m = len(self.parts), len(scenarios), len(self.molds)
+        inv = self.inv.values
+        demands = self.scenarios.values
+        max_molds = self.qty_molds.max()
+        max_cap = self.hours*self.arms*self.mounts
+        # P[j,i] = 1 if part i uses mold j
+        codes = pd.Categorical(self.data['mold'],categories=self.molds).codes
+        used = codes >= 0
+        P = sp.csr_matrix((np.ones(used.sum()),(codes[used],np.flatnonzero(used))),shape=(m,n))
+
+        # Big-M number for meeting demand
+        BIG_M1 = demands.max()
+        # Big-M number for objective funciton penalty for not meeting demand
+        BIG_M2 = 100000
+
+        # create decision variables
+        # x = [pro_vars (by part), a (by scenario then part), b (by mold), c (by mold)]
+        vtype = np.array([GRB.INTEGER]*n + [GRB.BINARY]*(n*S + 2*m))
+        x = self.model.addMVar(n + n*S + 2*m,vtype=vtype,name='x')
+        xs = x.tolist()
+        # same names and tupledicts as self.build_model so the rest of the class works as is
+        a_keys = [(i,s) for s in scenarios for i in self.parts]
+        names = (['pro_vars[{}]'.format(i) for i in self.parts] + ['a[{},{}]'.format(i,s) for i, s in a_keys]
+                 + ['b[{}]'.format(j) for j in self.molds] + ['c[{}]'.format(j) for j in self.molds])
+        self.model.setAttr('VarName',xs,names)
+        self.pro_vars = gp.tupledict(zip(self.parts,xs[:n]))
+        self.a = gp.tupledict(zip(a_keys,xs[n:n + n*S]))
+        self.b = gp.tupledict(zip(self.molds,xs[n + n*S:n + n*S + m]))
+        self.c = gp.tupledict(zip(self.molds,xs[n + n*S + m:]))
+
+        # column blocks of the constraint matrices
+        def row(pro=None, a=None, b=None, c=None, rows=1):
+            blocks = [(pro,n),(a,n*S),(b,m),(c,m)]
+            return sp.hstack([blk if blk is not None else sp.csr_matrix((rows,cols)) for blk, cols in blocks],format='csr')
+        I_n = sp.identity(n,format='csr')
+        I_m = sp.identity(m,format='csr')
+
+        # constraints, see self.build_model
+        # the sum of productions for all the parts that use a certain mold <= hours * available quantity of that mold
+        self.c1 = self.model.addConstr(row(pro=P,rows=m) @ x <= self.hours*self.qty_molds.values,name='const1')
+        # sum of production + (number of mounts per arm * molds with production between 1-23) <= max cap
+        self.c2 = self.model.addConstr(row(pro=sp.csr_matrix(np.ones((1,n))),c=sp.csr_matrix(np.full((1,m),-self.mounts))) @ x
+                                       <= np.array([max_cap - self.mounts*m]),name='const2')
+        # if production + inventory < demand of scenario s, then a[i,s] = 1
+        self.c3 = self.model.addConstr(row(pro=sp.vstack([I_n]*S,format='csr'),a=BIG_M1*sp.identity(n*S,format='csr'),rows=n*S) @ x
+                                       >= (demands - inv[:,None]).T.ravel(),name='const3')
+        # production + inventory - expected demand <= desired
+        self.c4 = self.model.addConstr(row(pro=I_n,rows=n) @ x <= (desired + self.demands - self.inv).values,name='const4')
+        # if production of a mold (all parts that use the mold) < 24, b = 0
+        self.c5 = self.model.addConstr(row(pro=-P,b=24*I_m,rows=m) @ x <= np.zeros(m),name='const5')
+        # if production of a mold is between 1-23, c = 0
+        self.c6 = self.model.addConstr(row(pro=P,b=-max_molds*self.hours*I_m,c=24*I_m,rows=m) @ x <= np.full(m,24),name='const6')
+
+        # objective function
+        # expected value over the scenarios of the objective of self.build_model
+        obj = np.concatenate((self.profits.values,-BIG_M2*np.repeat(self.weights.values,n),np.zeros(2*m)))
+        constant = self.profits.values @ (inv - self.demands.values)
+        self.obj = self.model.setObjective(obj @ x + constant,GRB.MAXIMIZE)
+        self.build_time = time.perf_counter() - start
+
+    def get_shortfalls(self):
+        """Return a pd.DataFrame indexed by part number with one column per
+        scenario, 1 where production + inventory doesn't meet the demand of
+        the scenario. Only for models built by self.build_scenario_model.
+        """
+        if not self.is_optimized():
+            return None
+        vals = np.array(self.model.getAttr('X',list(self.a.values())))
+        return pd.DataFrame(vals.reshape(len(self.scenarios.columns),len(self.parts)).T.round().astype(int),
+                            index=self.parts,columns=self.scenarios.columns)
+
     def update_production(self):
         """if the model is optimized ,create pd.Series of the production deteremined by the model (optimal solution)
         indexed by part numbers and assigns to self.prods.
@@ -188,8 +375,11 @@ class ProductionSchedule(BaseClass):
     """
 
     """
-    def __init__(self, hours, arms, mounts):
-        BaseClass.__init__(self,hours,arms,mounts,'Minimize_Mold_Change')
+    def __init__(self, hours, arms, mounts, env=None):
+        BaseClass.__init__(self,hours,arms,mounts,'Minimize_Mold_Change',env)
+        self.pool = None
+        # index of the pool solution picked by self.select_solution
+        self.selected = None
 
     def read_data(self, product_data, mold_data, prev_mount=None):
         """see BaseClass.read_data
@@ -283,7 +473,7 @@ class ProductionSchedule(BaseClass):
         # set objective function
         self.obj = self.model.setObjective(self.pro_vars.sum()-BIG_M2*self.c.sum(),GRB.MAXIMIZE)
 
-    def build_phase2(self):
+    def build_phase2(self, pool_size=1, pool_gap=None):
         """Changes self.model to a mold change minimization linear program from
         the attributes created by self.read_data.
         
@@ -295,6 +485,15 @@ class ProductionSchedule(BaseClass):
         have each mold making a product, instead of having both molds do half
         of each product.)
         
+        Parameters
+        ----------
+        pool_size: int--number of alternative schedules to keep in the
+            solver's solution pool (see self.update_pool)
+        pool_gap: float--only keep pool solutions whose phase2 objective
+            (a.sum() + a1.sum() - b.sum(), i.e., parts per mount plus mold
+            changes) is within pool_gap (relative, e.g., 0.1 for 10%) of the
+            best one. None for no limit.
+
         Notes
         -----
         This method only builds the model without optimizing it.
@@ -304,6 +503,13 @@ class ProductionSchedule(BaseClass):
         if self.is_optimized():
             # update production (self.prods) to the result from phase 1
             self.update_production()
+            # fix the shortfall indicators c to their phase1 values. they are not
+            # in the phase2 objective, so otherwise every on/off pattern of them
+            # counts as a different solution and fills the solution pool with copies
+            c_vars = [self.c[k] for k in self.parts]
+            c_vals = [round(v) for v in self.model.getAttr('X',c_vars)]
+            self.model.setAttr('LB',c_vars,c_vals)
+            self.model.setAttr('UB',c_vars,c_vals)
             # remove obsolete constraint
             self.model.remove(self.c8)
             # production for each part = to those from phase1's optimal solution
@@ -314,6 +520,15 @@ class ProductionSchedule(BaseClass):
             self.obj2 = self.model.setObjective(self.a.sum() + self.a1.sum() - self.b.sum(),GRB.MINIMIZE)
             # incase the obove assertion isn't true, we can use
             # self.obj2 = self.model.setObjective(self.a.sum() + BIG-M*(self.a1.sum() - self.b.sum()),GRB.MINIMIZE)
+
+            # solution pool
+            self.model.Params.PoolSolutions = pool_size
+            if pool_size > 1:
+                # look for the pool_size best solutions instead of keeping
+                # whatever solutions are found along the way
+                self.model.Params.PoolSearchMode = 2
+            if pool_gap is not None:
+                self.model.Params.PoolGap = pool_gap
         
     def update_production(self):
         """Store production by mold number in a pd.Series
@@ -338,44 +553,111 @@ class ProductionSchedule(BaseClass):
         have minimum mold changes
         """
         if self.is_optimized():
-            outer = dod.DeepOrderedDict()
-            for i in range(self.arms):
-                for j in range(self.mounts):
-                    # if there is production on this mount
-                    if self.pro_vars.sum(i,j,'*').getValue():
-                        key = '{}:{}'.format(i,j)
-                        outer[key] = dod.DeepOrderedDict()
-                        for h in self.molds:
-                            # if mold is mounted
-                            if self.a1[i,j,h].x == 1:
-                                outer[key][h] = dod.DeepOrderedDict([(k,int(self.pro_vars[i,j,k].x)) for k in self.data[self.data['mold']==h].index if self.pro_vars[i,j,k].x >0])
-            self.sched = outer
-            self.move_to_top()
+            # read all the values at once instead of one variable at a time
+            self.sched = self.make_schedule(self.model.getAttr('X',self.pro_vars),self.model.getAttr('X',self.a1))
+            self.selected = None
             return True
         else: 
             return False
+
+    def make_schedule(self, pro_vals, a1_vals):
+        """Return the production distribution given by the values pro_vals 
+        of self.pro_vars and a1_vals of self.a1 (dicts with the same keys as
+        the variables) as nested DeepOrderedDict, rearranged by self.move_to_top.
+        """
+        # parts that use each mold
+        mold_parts = {h:self.data[self.data['mold']==h].index for h in self.molds}
+        outer = dod.DeepOrderedDict()
+        for i in range(self.arms):
+            for j in range(self.mounts):
+                # if there is production on this mount
+                if sum(pro_vals[i,j,k] for k in self.parts) > 0.5:
+                    key = '{}:{}'.format(i,j)
+                    outer[key] = dod.DeepOrderedDict()
+                    for h in self.molds:
+                        # if mold is mounted
+                        if a1_vals[i,j,h] > 0.5:
+                            outer[key][h] = dod.DeepOrderedDict([(k,int(round(pro_vals[i,j,k]))) for k in mold_parts[h] if pro_vals[i,j,k] > 0.5])
+        self.move_to_top(outer)
+        return outer
         
-    def move_to_top(self):
+    def move_to_top(self, sched=None):
         """move molds that are mounted last from previous session to
-        the top of their respective mounts.
+        the top of their respective mounts in sched (self.sched if None).
+        Mounts with no production this session are not in sched and are skipped.
         """
+        if sched is None:
+            sched = self.sched
         for mount in self.prev_mount.index:
-            self.sched[mount].move_to_end(self.prev_mount[mount],last=False)
+            if mount in sched.keys():
+                sched[mount].move_to_end(self.prev_mount[mount],last=False)
     
-    def get_last_molds(self):
+    def get_last_molds(self, sched=None):
         """Return a pd.Series indexed by the mount number with the values being
-        the mold number of the last mold mounted on each mount.
+        the mold number of the last mold mounted on each mount of sched
+        (self.sched if None).
         """
-        if not self.sched:
+        if sched is None:
+            sched = self.sched
+        if not sched:
             return None
         cur_mount = dict()
-        for mt in self.sched:
-            cur_mount[mt] = self.sched[mt].get_end(what='key',depth=0)            
+        for mt in sched:
+            cur_mount[mt] = sched[mt].get_end(what='key',depth=0)            
         return pd.Series(cur_mount)
     
     def get_mold_changes(self):
+        # mold changes of the pool solution picked by self.select_solution if any,
+        # else of the best solution
+        if self.selected is not None:
+            return self.pool[self.selected]['mold_changes']
         return int((self.a1.sum()-self.b.sum()).getValue())
 
+    def update_pool(self):
+        """Store every solution in the solver's solution pool as a dict with 
+        keys obj (objective value), sched (see self.update_schedule), 
+        mold_changes and last_molds, in a list ordered from best to worst 
+        and assign to self.pool. Solutions that give the same schedule as
+        one already stored are skipped.
+
+        Notes
+        -----
+        The size of the pool is set by build_phase2. The first member is the
+        same schedule as the one from self.update_schedule.
+        """
+        if self.is_optimized():
+            self.pool = []
+            self.selected = None
+            for n in range(self.model.SolCount):
+                self.model.Params.SolutionNumber = n
+                pro_vals = self.model.getAttr('Xn',self.pro_vars)
+                a1_vals = self.model.getAttr('Xn',self.a1)
+                b_vals = self.model.getAttr('Xn',self.b)
+                sched = self.make_schedule(pro_vals,a1_vals)
+                if any(sched == member['sched'] for member in self.pool):
+                    continue
+                self.pool.append({'obj':self.model.PoolObjVal,
+                                  'sched':sched,
+                                  'mold_changes':int(round(sum(a1_vals.values())-sum(b_vals.values()))),
+                                  'last_molds':self.get_last_molds(sched)})
+            return True
+        else:
+            return False
+
+    def get_pool(self):
+        return self.pool
+
+    def select_solution(self, n):
+        """Make the n-th pool solution (see self.update_pool) the current 
+        schedule, so that self.write_schedule, self.get_last_molds and 
+        self.get_mold_changes use it.
+        """
+        if not self.pool or n >= len(self.pool):
+            return False
+        self.sched = self.pool[n]['sched']
+        self.selected = n
+        return True
+
     def write_schedule(self,wb,week=1,start_time=datetime.now().replace(second=0,microsecond=0)):
         """write the production schedule to wb openpyxl Workbook
         """
@@ -383,71 +665,280 @@ class ProductionSchedule(BaseClass):
         if not self.sched:
             # if self.sched is None (no real schedule), return False
             return False
-        # function start
-        old_time = start_time
-        current_time = old_time
         ws = wb.create_sheet('week{}'.format(week))
-        align_center = Alignment('center','center')
-        
-        # start entries on row 3, 1st and 2nd for titles, etc.
-        # 1st column for date, 2nd for time
-
-        # write first date in first entry
-        ws.cell(row=3,column=1,value=start_time.date())
-        # write time in all rows in 2nd column,
-        for i in range(3,self.hours+3):
-            ws.cell(row=i,column=2,value=current_time.time())
-            current_time = old_time + pd.Timedelta(hours=1)
-            # if date changes (next day), write date in 1st column
-            if current_time.date() != old_time.date():
-                ws.cell(row=i,column=1,value=current_time.date())
-            old_time = current_time
-        # set border and fit date/time column
-        set_border(ws,3,1,self.hours+2)
-        set_border(ws,3,2,self.hours+2)
-        fit_column(ws,3,1,self.hours+2)
-        fit_column(ws,3,2,self.hours+2)
-        # set border over top of schedule
-        set_border(ws,2,3,2,self.arms*self.mounts+2)
-
-        # enter productions
-        # first column of production entries
-        col = 3
-        for mt in self.sched:
-            # keys of self.sched are mount numbers
-            mount = self.sched[mt]
-            # enter column (mount) label
-            cell = ws.cell(2,col,mt)
-            cell.alignment = align_center
-            # start at row 3
-            row = 3
-            for h in mount:
-                # keys of mount are mold numbers
-                mold = mount[h]     
-                for k in mold:
-                    # keys of mold are part numbers
-                    cell = ws.cell(row,col,k)
-                    cell.alignment = align_center
-                    # if production of part k > 1,
-                    # enter production in the cell below
-                    if mold[k] > 1:
-                        ws.cell(row+1,col,mold[k])
-                    # set border for production of current part
-                    set_border(ws,row,col,row+mold[k]-1)
-                    # set row to current row + production hours of part
-                    row += mold[k]  
-                # skip one row for mold change
-                row += 1
-            # fit column width >= widest value in the column
-            fit_column(ws,3,col,self.hours+2)
-            # move col to the next column on the right
-            col += 1
-        # add freez panse 
-        ws.freeze_panes = 'C3'
+        write_sheet(ws,self.sched,self.hours,self.arms,self.mounts,start_time)
 
         return True
 
-    
 
+def schedule_machine(hours, arms, mounts, product_data, mold_data, prev_mount, term_conds, threads=0):
+    """Build and solve both phases of a ProductionSchedule for one machine.
 
-        
+    Module level (rather than a PlantSchedule method) so that it can be
+    pickled and run in a worker process by PlantSchedule.schedule.
+    Gurobi models can't be sent between processes, so only the results are
+    returned, as a dict with keys sched, produced, mold_changes and last_molds,
+    or None if the machine could not be scheduled.
+    The model gets its own Gurobi environment, as the default one may have 
+    been inherited from the parent process, limited to threads threads
+    (0 for all cores) so that the machines solved at the same time don't
+    compete for the same cores.
+    """
+    with gp.Env(empty=True) as env:
+        env.setParam('Threads',threads)
+        env.start()
+        model = ProductionSchedule(hours,arms,mounts,env)
+        model.read_data(product_data,mold_data,prev_mount)
+        model.build_phase1()
+        model.optimize(term_conds)
+        model.update_production()
+        model.build_phase2()
+        model.optimize(term_conds)
+        result = None
+        if model.update_schedule():
+            result = {'sched':model.get_schedule(),
+                      'produced':model.get_production(),
+                      'mold_changes':model.get_mold_changes(),
+                      'last_molds':model.get_last_molds()}
+        # the model has to go before its environment is closed
+        model.dispose()
+    return result
+
+class PlantSchedule(BaseClass):
+    """Schedule production for a plant with several rotational molding
+    machines that share one pool of molds.
+
+    A small master problem assigns every part to one machine and splits the
+    copies of each mold between the machines. Each machine's ProductionSchedule
+    is then solved in its own process, so the planning time grows with the
+    largest machine rather than with the sum of all machines.
+    """
+    def __init__(self, machines):
+        """
+        Parameters
+        ----------
+        machines: pd.DataFrame
+            a data frame indexed (row) by machine name (string) with columns
+            hours (int), arms (int), mounts (int). see BaseClass.__init__
+
+        Notes
+        -----
+        self.hours, self.arms and self.mounts are pd.Series indexed by 
+        machine name.
+        """
+        BaseClass.__init__(self,machines['hours'],machines['arms'],machines['mounts'],'Plant_Allocation')
+        self.machines = machines
+        self.alloc = None
+        self.results = None
+        self.errors = None
+        self.utilization = None
+
+    def read_data(self, product_data, mold_data, prev_mounts=None):
+        """see BaseClass.read_data
+
+        The difference is this method requires column produced (int),
+        for product_data (e.g., from MaxProfit.get_production)
+
+        Parameters
+        ----------
+        prev_mounts: dict
+            a dict keyed by machine name with values prev_mount as in 
+            ProductionSchedule.read_data. Machines not in the dict had
+            nothing mounted.
+        """
+        BaseClass.read_data(self,product_data,mold_data)
+        self.prods = self.data['produced']
+        self.prev_mounts = prev_mounts if prev_mounts is not None else dict()
+
+    def build_model(self):
+        """Build the plant allocation linear program from the attributes
+        created by self.read_data.
+
+        Assign each part to exactly one machine and each copy of a mold to at
+        most one machine so that the busiest machine (production hours plus 
+        mold changes over capacity) is as idle as possible.
+        Parts with no planned production (produced == 0) are not assigned.
+
+        Notes
+        -----
+        This method only builds the model without optimizing it.
+        The utilization z is not bounded by 1, so when the planned production
+        doesn't fit the plant the model is still solved and self.utilization
+        (see self.update_allocation) is above 1.
+        k is used to subscript part number, h for mold number and m for machine.
+        """
+        # prep data
+        machines = self.machines.index
+        hours = self.hours
+        # number of mounts on each machine
+        n_mounts = self.arms*self.mounts
+        max_cap = hours*n_mounts
+        # only parts with planned production need a machine, the others
+        # would take up a copy of their mold for nothing
+        planned = self.data[self.prods > 0]
+        self.planned = planned.index
+        # planned parts that use each mold
+        mold_parts = {h:planned[planned['mold']==h].index for h in self.molds}
+        # number of copies of mold h left mounted on machine m from the previous run.
+        # molds with no production planned are left out, there is no point
+        # keeping them on their machine
+        prev = dict()
+        for m in self.prev_mounts:
+            for h in self.prev_mounts[m]:
+                if h in mold_parts and len(mold_parts[h]) > 0:
+                    prev[h,m] = prev.get((h,m),0) + 1
+        # weight of the tie breaker that keeps the number of different molds
+        # on each machine (hence mold changes) low
+        EPS = 0.001
+
+        # create decision variables
+        # x[k,m] = 1 if part k is made on machine m
+        self.x = self.model.addVars(self.planned,machines,vtype=GRB.BINARY,name='x')
+        # y[h,m] copies of mold h given to machine m
+        self.y = self.model.addVars(self.molds,machines,vtype=GRB.INTEGER,name='y')
+        # u[h,m] = 1 if mold h is used on machine m
+        self.u = self.model.addVars(self.molds,machines,vtype=GRB.BINARY,name='u')
+        # utilization of the busiest machine
+        self.z = self.model.addVar(name='z')
+
+        # create constraints
+        # each part is made on exactly one machine
+        self.c1 = self.model.addConstrs((self.x.sum(k,'*') == 1 for k in self.planned), name='const1')
+        # u[h,m] = 1 if any part that uses mold h is made on machine m
+        self.c2 = self.model.addConstrs((self.x[k,m] <= self.u[h,m] for h in self.molds for k in mold_parts[h]
+                                         for m in machines), name='const2')
+        # y[h,m] >= 1 if u[h,m] = 1, and no more copies than there are mounts
+        self.c3 = self.model.addConstrs((self.u[h,m] <= self.y[h,m] for h in self.molds for m in machines), name='const3')
+        self.c4 = self.model.addConstrs((self.y[h,m] <= n_mounts[m]*self.u[h,m] for h in self.molds for m in machines), name='const4')
+        # production of a mold on a machine <= hours * copies of the mold on the machine
+        self.c5 = self.model.addConstrs((gp.LinExpr((self.prods[k],self.x[k,m]) for k in mold_parts[h]) <= hours[m]*self.y[h,m]
+                                         for h in self.molds for m in machines), name='const5')
+        # copies given out <= available quantity of the mold
+        self.c6 = self.model.addConstrs((self.y.sum(h,'*') <= self.qty_molds[h] for h in self.molds), name='const6')
+        # molds left mounted from the previous run stay on their machine
+        self.c7 = self.model.addConstrs((self.y[h,m] >= prev[h,m] for h,m in prev), name='const7')
+        # production + mold changes <= z * max cap, the first mold on each mount needs no change.
+        # a mold change stops the whole arm, so it costs an hour on every mount of the arm
+        # (see ProductionSchedule const7 and MaxProfit const2)
+        self.c8 = self.model.addConstrs((gp.LinExpr((self.prods[k],self.x[k,m]) for k in self.planned)
+                                         + self.mounts[m]*(self.y.sum('*',m) - n_mounts[m]) <= max_cap[m]*self.z for m in machines), name='const8')
+
+        # set objective function
+        self.obj = self.model.setObjective(self.z + EPS*self.u.sum(),GRB.MINIMIZE)
+
+    def update_allocation(self):
+        """if the model is optimized, store the product and mold data of each 
+        machine in a dict keyed by machine name and assign to self.alloc.
+
+        The values are (product_data, mold_data) tuples in the format taken by
+        ProductionSchedule.read_data. Machines with no parts are left out.
+        The utilization of the busiest machine is assigned to self.utilization,
+        above 1 means the machines can't make all the planned production.
+        """
+        if self.is_optimized():
+            self.utilization = self.z.x
+            self.alloc = dict()
+            for m in self.machines.index:
+                parts = [k for k in self.planned if self.x[k,m].x > 0.5]
+                if not parts:
+                    continue
+                qty = pd.Series({h:int(round(self.y[h,m].x)) for h in self.molds}, name='qty_mold')
+                self.alloc[m] = (self.data.loc[parts], qty[qty > 0].to_frame())
+            return True
+        else:
+            return False
+
+    def schedule(self, term_conds, max_workers=None):
+        """Solve the ProductionSchedule of every allocated machine, each in
+        its own process, and store the results in self.results.
+
+        Parameters
+        ----------
+        term_conds: list-like
+            see BaseClass.optimize, used for both phases on every machine
+        max_workers: int--number of processes, defaults to one per machine,
+            up to the number of cores
+
+        Notes
+        -----
+        Scripts calling this method must be guarded by 
+        if __name__ == '__main__': on platforms that spawn processes (Windows).
+        The cores are split evenly between the processes.
+        The exception of a machine that failed is stored in self.errors.
+        """
+        if not self.alloc:
+            return False
+        cpus = os.cpu_count() or 1
+        workers = max_workers or min(len(self.alloc),cpus)
+        threads = max(1,cpus//workers)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = dict()
+            for m, (product_data, mold_data) in self.alloc.items():
+                prev_mount = self.prev_mounts.get(m, pd.Series(dtype=object))
+                # only keep the molds that have production on this machine,
+                # otherwise ProductionSchedule mounts them on a mount with nothing to make
+                prev_mount = prev_mount[prev_mount.isin(product_data['mold'])]
+                futures[m] = executor.submit(schedule_machine,int(self.hours[m]),int(self.arms[m]),
+                                             int(self.mounts[m]),product_data,mold_data,prev_mount,term_conds,threads)
+            self.results = dict()
+            self.errors = dict()
+            for m in futures:
+                # a failed machine doesn't lose the schedules of the others.
+                # the exception keeps the worker's traceback (as __cause__)
+                try:
+                    self.results[m] = futures[m].result()
+                except Exception as exc:
+                    self.results[m] = None
+                    self.errors[m] = exc
+        return all(result is not None for result in self.results.values())
+
+    def get_allocation(self):
+        return self.alloc
+
+    def get_utilization(self):
+        return self.utilization
+
+    def get_errors(self):
+        # returns a dict of the exceptions of the failed machines keyed by machine name
+        return self.errors
+
+    def get_production(self):
+        # returns a pd.Series of production indexed by part number,
+        # 0 for the parts with no planned production
+        if not self.results:
+            return None
+        prods = [r['produced'] for r in self.results.values() if r is not None]
+        prods.append(pd.Series(0,index=self.parts.difference(self.planned),name='produced'))
+        return pd.concat(prods)
+
+    def get_schedule(self):
+        # returns a dict of schedules keyed by machine name
+        if not self.results:
+            return None
+        return {m:r['sched'] for m, r in self.results.items() if r is not None}
+
+    def get_mold_changes(self):
+        if not self.results:
+            return None
+        return pd.Series({m:r['mold_changes'] for m, r in self.results.items() if r is not None}, name='mold_changes')
+
+    def get_last_molds(self):
+        """Return a dict keyed by machine name of the last molds mounted 
+        (see ProductionSchedule.get_last_molds), to be used as prev_mounts
+        for the next run.
+        """
+        if not self.results:
+            return None
+        return {m:r['last_molds'] for m, r in self.results.items() if r is not None}
+
+    def write_schedule(self,wb,week=1,start_time=datetime.now().replace(second=0,microsecond=0)):
+        """write the production schedule of every machine to wb openpyxl
+        Workbook, one sheet per machine
+        """
+        sched = self.get_schedule()
+        if not sched:
+            return False
+        for m in sched:
+            ws = wb.create_sheet('week{}_{}'.format(week,m))
+            write_sheet(ws,sched[m],int(self.hours[m]),int(self.arms[m]),int(self.mounts[m]),start_time)
+        return True